@@ -2,25 +2,26 @@
 from __future__ import annotations
 
 import logging
-import os
+from functools import partial
 from pathlib import Path
 
-import aiohttp
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import ConfigEntryNotReady
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
     CONF_API_KEY,
     CONF_DATA_URL,
+    CONF_DOWNLOAD_URL,
     CONF_OPERATING_AREA,
+    CONF_PARALLEL_DOWNLOAD,
     DATA_DIR_NAME,
-    DEFAULT_DATA_URL_TEMPLATE,
+    DEFAULT_PARALLEL_DOWNLOAD,
     DOMAIN,
 )
 from .gtfs_data import GTFSDataManager
+from .util import build_data_url
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -39,39 +40,36 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     # Get configuration
     operating_area = entry.data.get(CONF_OPERATING_AREA)
-    api_key = entry.data.get(CONF_API_KEY)
-    data_url_template = entry.data.get(CONF_DATA_URL)
-
-    # Build the actual data URL
-    data_url = data_url_template.format(operating_area=operating_area)
-    
-    # Add API key as query parameter
-    if "?" in data_url:
-        data_url = f"{data_url}&key={api_key}"
-    else:
-        data_url = f"{data_url}?key={api_key}"
+    # Built by the config flow (or async_migrate_entry for older entries)
+    data_url = entry.data[CONF_DOWNLOAD_URL]
 
     # Ensure data directory exists
     config_dir = hass.config.path()
     data_dir = Path(config_dir) / DATA_DIR_NAME
     
     try:
-        data_dir.mkdir(exist_ok=True)
-        _LOGGER.info(f"Data directory ensured at: {data_dir}")
+        await hass.async_add_executor_job(partial(data_dir.mkdir, exist_ok=True))
+        _LOGGER.info("Data directory ensured at: %s", data_dir)
     except Exception as err:
-        _LOGGER.error(f"Failed to create data directory: {err}")
+        _LOGGER.error("Failed to create data directory: %s", err)
         raise ConfigEntryNotReady from err
 
-    # Initialize data manager
-    data_manager = GTFSDataManager(
-        hass=hass,
-        data_dir=data_dir,
-        data_url=data_url,
-        operating_area=operating_area,
+    # Initialize data manager (reads metadata from disk, so in the executor)
+    data_manager = await hass.async_add_executor_job(
+        partial(
+            GTFSDataManager,
+            hass=hass,
+            data_dir=data_dir,
+            data_url=data_url,
+            operating_area=operating_area,
+            parallel_download=entry.options.get(
+                CONF_PARALLEL_DOWNLOAD, DEFAULT_PARALLEL_DOWNLOAD
+            ),
+        )
     )
     
     # Check if database exists (initial setup)
-    if not data_manager.database_exists():
+    if not await hass.async_add_executor_job(data_manager.database_exists):
         _LOGGER.warning(
             "GTFS database not found. Please trigger an update via the Update entity "
             "to download and convert GTFS data."
@@ -92,6 +90,32 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Set up platforms
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    # Options are read when the data manager is created, reload on change
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+
+    return True
+
+
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the config entry when its options change."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Migrate an old config entry."""
+    if entry.version == 1 and entry.minor_version < 2:
+        # 1.2 stores the complete download URL in the entry
+        _LOGGER.debug("Migrating config entry to version 1.2")
+        data = {
+            **entry.data,
+            CONF_DOWNLOAD_URL: build_data_url(
+                entry.data[CONF_DATA_URL],
+                entry.data[CONF_OPERATING_AREA],
+                entry.data[CONF_API_KEY],
+            ),
+        }
+        hass.config_entries.async_update_entry(entry, data=data, minor_version=2)
+
     return True
 
 
@@ -2,31 +2,105 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import Mapping
 from typing import Any
 
 import voluptuous as vol
 
 from homeassistant import config_entries
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers import selector
 
 from .const import (
     CONF_API_KEY,
     CONF_DATA_URL,
+    CONF_DOWNLOAD_URL,
     CONF_OPERATING_AREA,
+    CONF_PARALLEL_DOWNLOAD,
     DEFAULT_DATA_URL_TEMPLATE,
     DEFAULT_OPERATING_AREA,
+    DEFAULT_PARALLEL_DOWNLOAD,
     DOMAIN,
 )
+from .util import build_data_url
 
 _LOGGER = logging.getLogger(__name__)
 
+# Selectors are stateless, so they are built once and shared by both steps
+_API_KEY_SELECTOR = selector.TextSelector(
+    selector.TextSelectorConfig(
+        type=selector.TextSelectorType.PASSWORD,
+        autocomplete="off",
+    ),
+)
+_OPERATING_AREA_SELECTOR = selector.TextSelector()
+_DATA_URL_SELECTOR = selector.TextSelector(
+    selector.TextSelectorConfig(
+        type=selector.TextSelectorType.URL,
+    ),
+)
+_PARALLEL_DOWNLOAD_SELECTOR = selector.BooleanSelector()
+
+STEP_USER_DATA_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_API_KEY): _API_KEY_SELECTOR,
+        vol.Optional(
+            CONF_OPERATING_AREA, default=DEFAULT_OPERATING_AREA
+        ): _OPERATING_AREA_SELECTOR,
+        vol.Optional(
+            CONF_DATA_URL,
+            default=DEFAULT_DATA_URL_TEMPLATE,
+        ): _DATA_URL_SELECTOR,
+    }
+)
+
+
+def _reconfigure_schema(data: Mapping[str, Any]) -> vol.Schema:
+    """Build the reconfigure schema with the current values as defaults."""
+    return vol.Schema(
+        {
+            vol.Required(
+                CONF_API_KEY,
+                default=data.get(CONF_API_KEY)
+            ): _API_KEY_SELECTOR,
+            vol.Optional(
+                CONF_OPERATING_AREA,
+                default=data.get(CONF_OPERATING_AREA, DEFAULT_OPERATING_AREA)
+            ): _OPERATING_AREA_SELECTOR,
+            vol.Optional(
+                CONF_DATA_URL,
+                default=data.get(CONF_DATA_URL, DEFAULT_DATA_URL_TEMPLATE)
+            ): _DATA_URL_SELECTOR,
+        }
+    )
+
+
+def _options_schema(options: Mapping[str, Any]) -> vol.Schema:
+    """Build the options schema with the current values as defaults."""
+    return vol.Schema(
+        {
+            vol.Optional(
+                CONF_PARALLEL_DOWNLOAD,
+                default=options.get(CONF_PARALLEL_DOWNLOAD, DEFAULT_PARALLEL_DOWNLOAD)
+            ): _PARALLEL_DOWNLOAD_SELECTOR,
+        }
+    )
+
 
 class GTFSSkaneConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for GTFS Skåne."""
 
     VERSION = 1
+    MINOR_VERSION = 2
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> GTFSSkaneOptionsFlow:
+        """Get the options flow for this handler."""
+        return GTFSSkaneOptionsFlow()
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
@@ -54,35 +128,16 @@ class GTFSSkaneConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         CONF_OPERATING_AREA: operating_area,
                         CONF_DATA_URL: data_url,
                         CONF_API_KEY: api_key,
+                        CONF_DOWNLOAD_URL: build_data_url(
+                            data_url, operating_area, api_key
+                        ),
                     },
                 )
 
         # Show form
-        data_schema = vol.Schema(
-            {
-                vol.Required(CONF_API_KEY): selector.TextSelector(
-                    selector.TextSelectorConfig(
-                        type=selector.TextSelectorType.PASSWORD,
-                        autocomplete="off",
-                    ),
-                ),
-                vol.Optional(
-                    CONF_OPERATING_AREA, default=DEFAULT_OPERATING_AREA
-                ): selector.TextSelector(),
-                vol.Optional(
-                    CONF_DATA_URL, 
-                    default=DEFAULT_DATA_URL_TEMPLATE,
-                ): selector.TextSelector(
-                    selector.TextSelectorConfig(
-                        type=selector.TextSelectorType.URL,
-                    ),
-                ),
-            }
-        )
-
         return self.async_show_form(
             step_id="user", 
-            data_schema=data_schema, 
+            data_schema=STEP_USER_DATA_SCHEMA, 
             errors=errors,
         )
 
@@ -109,38 +164,33 @@ class GTFSSkaneConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         CONF_OPERATING_AREA: operating_area,
                         CONF_DATA_URL: data_url,
                         CONF_API_KEY: user_input[CONF_API_KEY],
+                        CONF_DOWNLOAD_URL: build_data_url(
+                            data_url, operating_area, user_input[CONF_API_KEY]
+                        ),
                     },
                 )
 
         # Pre-fill form with current values
-        data_schema = vol.Schema(
-            {
-                vol.Required(
-                    CONF_API_KEY, 
-                    default=entry.data.get(CONF_API_KEY)
-                ): selector.TextSelector(
-                    selector.TextSelectorConfig(
-                        type=selector.TextSelectorType.PASSWORD,
-                        autocomplete="off",
-                    ),
-                ),
-                vol.Optional(
-                    CONF_OPERATING_AREA,
-                    default=entry.data.get(CONF_OPERATING_AREA, DEFAULT_OPERATING_AREA)
-                ): selector.TextSelector(),
-                vol.Optional(
-                    CONF_DATA_URL,
-                    default=entry.data.get(CONF_DATA_URL, DEFAULT_DATA_URL_TEMPLATE)
-                ): selector.TextSelector(
-                    selector.TextSelectorConfig(
-                        type=selector.TextSelectorType.URL,
-                    ),
-                ),
-            }
-        )
+        data_schema = _reconfigure_schema(entry.data)
 
         return self.async_show_form(
             step_id="reconfigure",
             data_schema=data_schema,
             errors=errors,
         )
+
+
+class GTFSSkaneOptionsFlow(config_entries.OptionsFlow):
+    """Handle options for GTFS Skåne."""
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(data=user_input)
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=_options_schema(self.config_entry.options),
+        )
@@ -6,10 +6,13 @@ DOMAIN = "gtfs_skane"
 CONF_DATA_URL = "data_url"
 CONF_OPERATING_AREA = "operating_area"
 CONF_API_KEY = "api_key"
+CONF_DOWNLOAD_URL = "download_url"  # data URL with operating area and API key applied
+CONF_PARALLEL_DOWNLOAD = "parallel_download"
 
 # Default values
 DEFAULT_OPERATING_AREA = "skane"
 DEFAULT_DATA_URL_TEMPLATE = "https://opendata.samtrafiken.se/gtfs/{operating_area}/{operating_area}.zip"
+DEFAULT_PARALLEL_DOWNLOAD = False
 
 # Data directory
 DATA_DIR_NAME = "gtfs_skane"
@@ -1,7 +1,26 @@
+import json
+import os
 import sqlite3
+import threading
 
-from typing import TypedDict, List
+from datetime import datetime, time, timedelta
+from collections.abc import Sequence
+from functools import lru_cache
+from pathlib import Path
+from time import monotonic
+from types import MappingProxyType
+from typing import TypedDict, List, cast
 
+from homeassistant.core import HomeAssistant
+
+# How far ahead departures are prefetched, and how long they are reused.
+# Routes with fewer than three departures within the horizon are fetched
+# again without one.
+DEPARTURE_HORIZON_MINUTES = 24 * 60
+DEPARTURE_CACHE_TTL = 60  # seconds
+
+# Stops and routes are handed out as read-only views of these shapes, see
+# _query_stop_info
 class Route(TypedDict):
     id: str
     short_name: str
@@ -24,207 +43,378 @@ class Stop(TypedDict):
     timezone: str
     wheelchair_boarding: str
     platform_code: str
-    routes: List[Route]
+    routes: tuple[Route, ...]
+
+# Departures are stored as offsets from 1970-01-01 (times past midnight roll
+# over to 1970-01-02), so each service day is queried separately and mapped
+# onto a real date. The branches cover disjoint service days, hence UNION ALL,
+# and each one only reads stop times that can still be in the future.
+# All dates are bound from Python, see _service_day_params. Departures for
+# every route of the stop are fetched in one go, see prefetch_departures.
+_DEPARTURES_SQL = """
+WITH baseData AS (
+    SELECT
+        CASE WHEN date(st.departure_time) = '1970-01-01'
+            THEN :yesterday || ' ' || time(st.departure_time)
+            ELSE :today || ' ' || time(st.departure_time)
+        END AS correctDepartureDateTime,
+        t.route_id,
+        st.stop_headsign
+    FROM trips t
+    INNER JOIN stop_times st ON st.trip_id = t.trip_id
+    INNER JOIN calendar_dates cd ON cd.service_id = t.service_id
+    WHERE t.route_id IN (SELECT value FROM json_each(:route_ids))
+    AND st.stop_id = :origin_station_id
+    AND t.direction_id = 1
+    AND cd.date = :yesterday
+    AND st.departure_time >= :yesterday_min_departure
+    UNION ALL
+    SELECT
+        CASE WHEN date(st.departure_time) = '1970-01-01'
+            THEN :today || ' ' || time(st.departure_time)
+            ELSE :tomorrow || ' ' || time(st.departure_time)
+        END AS correctDepartureDateTime,
+        t.route_id,
+        st.stop_headsign
+    FROM trips t
+    INNER JOIN stop_times st ON st.trip_id = t.trip_id
+    INNER JOIN calendar_dates cd ON cd.service_id = t.service_id
+    WHERE t.route_id IN (SELECT value FROM json_each(:route_ids))
+    AND st.stop_id = :origin_station_id
+    AND t.direction_id = 1
+    AND cd.date = :today
+    AND st.departure_time >= :today_min_departure
+    UNION ALL
+    SELECT
+        CASE WHEN date(st.departure_time) = '1970-01-01'
+            THEN :tomorrow || ' ' || time(st.departure_time)
+            ELSE :day_after_tomorrow || ' ' || time(st.departure_time)
+        END AS correctDepartureDateTime,
+        t.route_id,
+        st.stop_headsign
+    FROM trips t
+    INNER JOIN stop_times st ON st.trip_id = t.trip_id
+    INNER JOIN calendar_dates cd ON cd.service_id = t.service_id
+    WHERE t.route_id IN (SELECT value FROM json_each(:route_ids))
+    AND st.stop_id = :origin_station_id
+    AND t.direction_id = 1
+    AND cd.date = :tomorrow
+    AND st.departure_time >= :tomorrow_min_departure
+)
+SELECT
+    route_id,
+    correctDepartureDateTime AS departureDateTime,
+    time(correctDepartureDateTime) AS departureTime,
+    stop_headsign
+FROM baseData
+WHERE correctDepartureDateTime > :now_local
+AND (:horizon IS NULL OR correctDepartureDateTime <= :horizon)
+ORDER BY correctDepartureDateTime ASC
+"""
+
+# Stop details are read once; the routes serving the stop are deduplicated
+# on their own narrow projection instead of grouping every joined column.
+_STOP_SQL = """
+SELECT
+    stop_id,
+    stop_name,
+    stop_lat,
+    stop_lon,
+    location_type,
+    parent_station,
+    wheelchair_boarding,
+    platform_code
+FROM stops
+WHERE stop_id = :stop_id
+LIMIT 1
+"""
+
+_STOP_ROUTES_SQL = """
+SELECT DISTINCT
+    r.route_id,
+    r.agency_id,
+    a.agency_name,
+    a.agency_url,
+    a.agency_timezone,
+    r.route_short_name,
+    r.route_long_name,
+    r.route_desc,
+    r.route_type,
+    t.direction_id,
+    st.stop_headsign
+FROM stop_times st
+INNER JOIN trips t ON st.trip_id = t.trip_id
+INNER JOIN routes r ON t.route_id = r.route_id
+INNER JOIN agency a ON r.agency_id = a.agency_id
+WHERE st.stop_id = :stop_id
+"""
+
+_GTFS_EPOCH = datetime(1970, 1, 1)
+
+
+def _service_day_params(now: datetime) -> dict[str, str]:
+    """Build the date parameters for _DEPARTURES_SQL from a local time."""
+    params = {"now_local": now.strftime("%Y-%m-%d %H:%M:%S")}
+    today = datetime.combine(now.date(), time.min)
+    for name, offset in (
+        ("yesterday", -1),
+        ("today", 0),
+        ("tomorrow", 1),
+        ("day_after_tomorrow", 2),
+    ):
+        service_day = today + timedelta(days=offset)
+        params[name] = service_day.strftime("%Y-%m-%d")
+        # Earliest stored departure on this service day that is not yet past
+        min_departure = _GTFS_EPOCH + (now - service_day)
+        params[f"{name}_min_departure"] = min_departure.strftime("%Y-%m-%d %H:%M:%S")
+    return params
+
+
+@lru_cache(maxsize=256)
+def _query_stop_info(
+    db_path: str, db_mtime_ns: int, stop_id: str
+) -> Stop | None:
+    """Load a stop and the routes serving it.
+
+    db_mtime_ns is only part of the cache key, so replacing the database
+    invalidates the cached entries. The result is shared between callers,
+    so the stop and its routes are returned as read-only views.
+    """
+    conn = sqlite3.connect(
+        Path(db_path).absolute().as_uri() + "?mode=ro",
+        uri=True,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row  # allows dict-like access
+    try:
+        general_data = conn.execute(_STOP_SQL, {"stop_id": stop_id}).fetchone()
+        if general_data is None:
+            return None
+
+        # Build routes while streaming rows instead of materializing them first.
+        # TypedDicts are plain dicts at runtime, so build them as literals.
+        timezone = None
+        routes: List[Route] = []
+        for row in conn.execute(_STOP_ROUTES_SQL, {"stop_id": stop_id}):
+            if timezone is None:
+                timezone = row["agency_timezone"]
+            routes.append(cast(Route, MappingProxyType({
+                "id": row["route_id"],
+                "short_name": row["route_short_name"],
+                "long_name": row["route_long_name"],
+                "description": row["route_desc"],
+                "type": row["route_type"],
+                "direction": row["direction_id"],
+                "agency_id": row["agency_id"],
+                "agency_name": row["agency_name"],
+                "agency_url": row["agency_url"],
+                "headsign": row["stop_headsign"],
+            })))
+    finally:
+        conn.close()
+
+    if len(routes) == 0:
+        return None
+
+    return cast(Stop, MappingProxyType({
+        "id": general_data["stop_id"],
+        "name": general_data["stop_name"],
+        "lat": general_data["stop_lat"],
+        "lon": general_data["stop_lon"],
+        "location_type": general_data["location_type"],
+        "parent_station": general_data["parent_station"],
+        "timezone": timezone,
+        "wheelchair_boarding": general_data["wheelchair_boarding"],
+        "platform_code": general_data["platform_code"],
+        "routes": tuple(routes),
+    }))
+
 
 class GTFSBackend:
-    def __init__(self, db_path: str, stop_id: str):
+    def __init__(self, hass: HomeAssistant, db_path: str, stop_id: str):
+        self._hass = hass
         self._db_path = db_path
         self._stop_id = stop_id
         self._stop: Stop | None = None
-        self._routes: List[Route] = []
+        self._routes: Sequence[Route] = ()
         self._db_state = "noDb"
-        self._departures = []
+        self._departures: dict[str, list[dict]] = {}
+        self._departures_fetched_at: float | None = None
+        # Routes whose departures were fetched without a horizon
+        self._unbounded_routes: set[str] = set()
         self._active_routes: List[str] = []
+        self._conn: sqlite3.Connection | None = None
+        # Inode and mtime of the database file the connection was opened on
+        self._conn_db_id: tuple[int, int] | None = None
+        # The connection is shared by executor threads, one query at a time
+        self._conn_lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return the cached database connection, opening it on first use.
 
-    def get_next_departure(self) -> dict:
-        """Get the next departures for the given schedule."""
-        sql_query = f"""
-            WITH baseData AS (
-                SELECT 
-                    CASE WHEN date(st.departure_time) = '1970-01-01' 
-                        THEN date('now', '-1 day') || ' ' || time(st.departure_time)
-                        ELSE date('now') || ' ' || time(st.departure_time)
-                    END AS correctDepartureDateTime,
-                    st.stop_headsign
-                FROM trips t
-                INNER JOIN stop_times st ON st.trip_id = t.trip_id
-                INNER JOIN stops s ON st.stop_id = s.stop_id
-                WHERE t.route_id = :route_id
-                AND st.stop_id = :origin_station_id
-                AND t.direction_id = 1
-                AND t.service_id in (SELECT service_id from calendar_dates where date = date('now', '-1 day'))
-                UNION
-                SELECT 
-                    CASE WHEN date(st.departure_time) = '1970-01-01' 
-                        THEN date('now') || ' ' || time(st.departure_time)
-                        ELSE date('now', '+1 day') || ' ' || time(st.departure_time)
-                    END AS correctDepartureDateTime,
-                    st.stop_headsign
-                FROM trips t
-                INNER JOIN stop_times st ON st.trip_id = t.trip_id
-                INNER JOIN stops s ON st.stop_id = s.stop_id
-                WHERE t.route_id = :route_id
-                AND st.stop_id = :origin_station_id
-                AND t.direction_id = 1
-                AND t.service_id in (SELECT service_id from calendar_dates where date = date('now'))
-                UNION
-                SELECT 
-                    CASE WHEN date(st.departure_time) = '1970-01-01' 
-                        THEN date('now', '+1 day') || ' ' || time(st.departure_time)
-                        ELSE date('now', '+2 day') || ' ' || time(st.departure_time)
-                    END AS correctDepartureDateTime,
-                    st.stop_headsign
-                FROM trips t
-                INNER JOIN stop_times st ON st.trip_id = t.trip_id
-                INNER JOIN stops s ON st.stop_id = s.stop_id
-                WHERE t.route_id = :route_id
-                AND st.stop_id = :origin_station_id
-                AND t.direction_id = 1
-                AND t.service_id in (SELECT service_id from calendar_dates where date = date('now', '+1 day'))
-                ORDER BY correctDepartureDateTime ASC
-                )
-                SELECT 
-                    correctDepartureDateTime AS departureDateTime,
-                    time(correctDepartureDateTime) AS departureTime,
-                    stop_headsign
-                FROM baseData 
-                WHERE correctDepartureDateTime > datetime('now', 'localtime')
-                LIMIT 3
-            """
-
-        conn = sqlite3.connect(self._db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row  # allows dict-like access
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                sql_query,
-                {
-                    "origin_station_id": self._stop_id,
-                    "route_id": "9011012001600000",
-                },
+        An update replaces the database file, in which case the connection
+        to the old file is closed and one to the new file is opened.
+        """
+        stat = os.stat(self._db_path)
+        db_id = (stat.st_ino, stat.st_mtime_ns)
+        if self._conn is not None and self._conn_db_id != db_id:
+            self._conn.close()
+            self._conn = None
+
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self._db_path, check_same_thread=False, isolation_level=None
+            )
+            conn.row_factory = sqlite3.Row  # allows dict-like access
+            # The converter leaves the database in WAL mode, changing the
+            # journal mode here would be a write
+            conn.executescript(
+                """
+                PRAGMA mmap_size=268435456;
+                PRAGMA cache_size=-20000;
+                PRAGMA temp_store=MEMORY;
+                """
             )
-            rows = cursor.fetchall()
+            self._conn = conn
+            self._conn_db_id = db_id
+        return self._conn
+
+    def close(self) -> None:
+        """Close the cached database connection."""
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._conn_db_id = None
+
+    def prefetch_departures(
+        self, horizon_minutes: int = DEPARTURE_HORIZON_MINUTES
+    ) -> None:
+        """Fetch upcoming departures for all active routes of the stop."""
+        with self._conn_lock:
+            self._prefetch_departures(horizon_minutes)
+
+    def _prefetch_departures(self, horizon_minutes: int) -> None:
+        """Fetch upcoming departures, the caller holds _conn_lock."""
+        now = datetime.now()
+        horizon = now + timedelta(minutes=horizon_minutes)
+        departures = self._query_departures(now, self._active_routes, horizon)
+
+        # Sparse routes may have their next departures beyond the horizon
+        short_routes = [
+            route_id
+            for route_id, route_departures in departures.items()
+            if len(route_departures) < 3
+        ]
+        if short_routes:
+            departures.update(self._query_departures(now, short_routes, None))
+
+        self._departures = departures
+        self._unbounded_routes = set(short_routes)
+        self._departures_fetched_at = monotonic()
+
+    def _query_departures(
+        self, now: datetime, route_ids: List[str], horizon: datetime | None
+    ) -> dict[str, list[dict]]:
+        """Query departures of the given routes up to the horizon, if any."""
+        departures: dict[str, list[dict]] = {route_id: [] for route_id in route_ids}
+        horizon_param = (
+            None if horizon is None else horizon.strftime("%Y-%m-%d %H:%M:%S")
+        )
+        rows = self._get_connection().execute(
+            _DEPARTURES_SQL,
+            {
+                "origin_station_id": self._stop_id,
+                "route_ids": json.dumps(route_ids),
+                "horizon": horizon_param,
+                **_service_day_params(now),
+            },
+        )
+        for row in rows:
+            departures[row["route_id"]].append({
+                "dateTime": row["departureDateTime"],
+                "time": row["departureTime"],
+                "headsign": row["stop_headsign"],
+            })
+        return departures
 
-            departures = []
-            for row in rows:
-                departures.append({
-                    "dateTime": row["departureDateTime"],
-                    "time": row["departureTime"],
-                    "headsign": row["stop_headsign"],
-                })
+    def _upcoming_departures(self, route_id: str) -> list[dict]:
+        """Return the next three cached departures of the route."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return [
+            departure
+            for departure in self._departures.get(route_id, [])
+            if departure["dateTime"] > now
+        ][:3]
 
-            if len(departures) < 3:
-                return None
+    def get_next_departure(self, route_id: str) -> dict | None:
+        """Get the next departures for the given route."""
+        # Checked and refreshed under the lock, so concurrent callers don't
+        # all refresh the departures
+        with self._conn_lock:
+            if (
+                self._departures_fetched_at is None
+                or monotonic() - self._departures_fetched_at > DEPARTURE_CACHE_TTL
+            ):
+                self._prefetch_departures(DEPARTURE_HORIZON_MINUTES)
 
-            return {
-                "nextDeparture": departures[0],
-                "secondDeparture": departures[1],
-                "thirdDeparture": departures[2],
-            }
-        finally:
-            conn.close()
+            departures = self._upcoming_departures(route_id)
+            if len(departures) < 3 and route_id not in self._unbounded_routes:
+                # Cached departures within the horizon have run out
+                self._prefetch_departures(DEPARTURE_HORIZON_MINUTES)
+                departures = self._upcoming_departures(route_id)
 
+        if len(departures) < 3:
+            return None
+
+        return {
+            "nextDeparture": departures[0],
+            "secondDeparture": departures[1],
+            "thirdDeparture": departures[2],
+        }
 
     def set_stop_info(self):
-        sql_query = f"""
-            SELECT 
-                s.stop_id,
-                s.stop_name,
-                s.stop_lat,
-                s.stop_lon,
-                s.location_type,
-                s.parent_station,
-                s.wheelchair_boarding,
-                s.platform_code,
-                r.route_id,
-                r.agency_id,
-                a.agency_name,
-                a.agency_url,
-                a.agency_timezone,
-                r.route_short_name,
-                r.route_long_name,
-                r.route_desc,
-                r.route_type,
-                t.direction_id,
-                st.stop_headsign
-            FROM stops s
-            INNER JOIN stop_times st ON st.stop_id = s.stop_id
-            INNER JOIN trips t ON st.trip_id = t.trip_id
-            INNER JOIN routes r ON t.route_id = r.route_id
-            INNER JOIN agency a ON r.agency_id = a.agency_id
-            WHERE s.stop_id = :stop_id
-            GROUP BY 
-                s.stop_id,
-                s.stop_name,
-                s.stop_lat,
-                s.stop_lon,
-                s.location_type,
-                s.parent_station,
-                s.wheelchair_boarding,
-                s.platform_code,
-                r.route_id,
-                r.agency_id,
-                a.agency_name,
-                a.agency_url,
-                a.agency_timezone,
-                r.route_short_name,
-                r.route_long_name,
-                r.route_desc,
-                r.route_type,
-                t.direction_id,
-                st.stop_headsign
-            """
-
-        conn = sqlite3.connect(self._db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row  # allows dict-like access
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                sql_query,
-                {
-                    "stop_id": self._stop_id,
-                },
-            )
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                self._routes = []
-                self._stop = None
-                return None
-
-
-            for row in rows:
-                self._active_routes.append(row["route_id"])
-                self._routes.append(Route(
-                    id = row["route_id"],
-                    short_name = row["route_short_name"],
-                    long_name = row["route_long_name"],
-                    description = row["route_desc"],
-                    type = row["route_type"],
-                    direction = row["direction_id"],
-                    agency_id = row["agency_id"],
-                    agency_name = row["agency_name"],
-                    agency_url = row["agency_url"],
-                    headsign = row["stop_headsign"]
-                ))
-            general_data = rows[0]
-            self._stop = Stop(
-                id=general_data["stop_id"],
-                name=general_data["stop_name"],
-                lat=general_data["stop_lat"],
-                lon=general_data["stop_lon"],
-                location_type=general_data["location_type"],
-                parent_station=general_data["parent_station"],
-                timezone=general_data["agency_timezone"],
-                wheelchair_boarding=general_data["wheelchair_boarding"],
-                platform_code=general_data["platform_code"],
-                routes=self._routes
-            )
+        # Stop info only changes when the database is rebuilt, so it is shared
+        # between backends via a cache keyed on the database modification time
+        db_mtime_ns = os.stat(self._db_path).st_mtime_ns
+        self._stop = _query_stop_info(self._db_path, db_mtime_ns, self._stop_id)
+        if self._stop is None:
+            self._routes = ()
+            self._active_routes = []
+            return None
+
+        self._routes = self._stop["routes"]
+        # A route served in both directions is listed once per direction
+        self._active_routes = list(dict.fromkeys(
+            route["id"] for route in self._routes
+        ))
+
+    async def async_set_stop_info(self) -> None:
+        """Load stop info in the executor."""
+        await self._hass.async_add_executor_job(self.set_stop_info)
+
+    async def async_prefetch_departures(
+        self, horizon_minutes: int = DEPARTURE_HORIZON_MINUTES
+    ) -> None:
+        """Fetch upcoming departures in the executor."""
+        await self._hass.async_add_executor_job(
+            self.prefetch_departures, horizon_minutes
+        )
+
+    async def async_get_next_departure(self, route_id: str) -> dict | None:
+        """Get the next departures for the given route in the executor."""
+        return await self._hass.async_add_executor_job(
+            self.get_next_departure, route_id
+        )
 
-        finally:
-            conn.close()
+    async def async_close(self) -> None:
+        """Close the cached database connection in the executor."""
+        await self._hass.async_add_executor_job(self.close)
 
     def get_stop(self) -> Stop | None:
+        """Get a read-only view of the stop."""
         return self._stop
 
-    def get_routes(self) -> list[Route] | None:
+    def get_routes(self) -> Sequence[Route]:
+        """Get read-only views of the routes serving the stop."""
         return self._routes
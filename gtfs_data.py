@@ -2,25 +2,55 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import hashlib
+import json
 import logging
+import os
 import shutil
+import sqlite3
 import zipfile
+from collections.abc import Callable, Iterable, Mapping
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, BinaryIO
 
 import aiohttp
 import pygtfs
+from sqlalchemy import event
 from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
+from .gtfs_loader import append_feed
+
 _LOGGER = logging.getLogger(__name__)
 
 # Retry configuration
 MAX_DOWNLOAD_RETRIES = 3
 RETRY_DELAYS = [5, 15, 30]  # seconds between retries
 
+# Database configuration
+DB_PAGE_SIZE = 8192
+# The database is rebuilt from scratch on every update, so durability is
+# traded for speed while loading it
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",  # 256 MiB
+]
+# Feed files no query reads. shapes.txt is by far the largest file of a feed.
+DEFAULT_SKIP_TABLES = frozenset({"shapes"})
+INDEX_SORT_THREADS = min(os.cpu_count() or 1, 4)  # helper threads per index sort
+
+# Download configuration
+DOWNLOAD_WRITE_BUFFER_SIZE = 1024 * 1024  # bytes buffered per executor write
+PARALLEL_DOWNLOAD_PARTS = 8
+PARALLEL_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024  # smaller files use one stream
+
 
 class GTFSDataManager:
     """Manages GTFS data download, conversion, and validation."""
@@ -31,14 +61,25 @@ class GTFSDataManager:
         data_dir: Path,
         data_url: str,
         operating_area: str,
+        skip_tables: Iterable[str] = DEFAULT_SKIP_TABLES,
+        parallel_download: bool = False,
     ) -> None:
-        """Initialize the data manager."""
+        """Initialize the data manager.
+
+        Tables in skip_tables are left empty when the feed is converted.
+        With parallel_download, large zips are fetched as concurrent byte
+        ranges, at the cost of a HEAD request and one request per part
+        against the API key's quota.
+        """
         self.hass = hass
         self.data_dir = data_dir
         self.data_url = data_url
         self.operating_area = operating_area
+        self.skip_tables = frozenset(skip_tables)
+        self.parallel_download = parallel_download
         
         self.zip_path = data_dir / f"{operating_area}.zip"
+        self.zip_part_path = data_dir / f"{operating_area}.zip.part"
         self.db_path = data_dir / f"{operating_area}.sqlite"
         self.metadata_path = data_dir / "metadata.json"
         
@@ -49,14 +90,16 @@ class GTFSDataManager:
         }
         
         self._metadata = self._load_metadata()
+        self._download_validators: dict[str, str | None] = {}
+        self._download_digest: str | None = None
 
-    def get_state(self) -> dict[str, Any]:
-        """Get current update state."""
-        return self._state.copy()
+    def get_state(self) -> Mapping[str, Any]:
+        """Get a read-only view of the current update state."""
+        return MappingProxyType(self._state)
 
-    def get_metadata(self) -> dict[str, Any]:
-        """Get data metadata."""
-        return self._metadata.copy()
+    def get_metadata(self) -> Mapping[str, Any]:
+        """Get a read-only view of the data metadata."""
+        return MappingProxyType(self._metadata)
 
     def _load_metadata(self) -> dict[str, Any]:
         """Load metadata from file."""
@@ -64,7 +107,6 @@ class GTFSDataManager:
             return {}
         
         try:
-            import json
             with open(self.metadata_path, "r") as f:
                 data = json.load(f)
                 # Convert ISO strings back to datetime
@@ -72,51 +114,74 @@ class GTFSDataManager:
                     data["last_download"] = datetime.fromisoformat(data["last_download"])
                 return data
         except Exception as err:
-            _LOGGER.warning(f"Failed to load metadata: {err}")
+            _LOGGER.warning("Failed to load metadata: %s", err)
             return {}
 
     def _save_metadata(self) -> None:
         """Save metadata to file."""
+        tmp_path = self.metadata_path.with_suffix(".json.tmp")
         try:
-            import json
             # Convert datetime to ISO string for JSON serialization
             data = self._metadata.copy()
             if "last_download" in data and isinstance(data["last_download"], datetime):
                 data["last_download"] = data["last_download"].isoformat()
             
-            with open(self.metadata_path, "w") as f:
-                json.dump(data, f, indent=2)
+            # Write to a temporary file and swap it in, so a crash while
+            # saving never leaves a truncated metadata file behind. The file
+            # is small and rarely written, so it is synced before the swap
+            # to survive a power loss too.
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.metadata_path)
         except Exception as err:
-            _LOGGER.error(f"Failed to save metadata: {err}")
+            _LOGGER.error("Failed to save metadata: %s", err)
+            with contextlib.suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
 
     async def update_data(self) -> None:
         """Download and convert GTFS data."""
         try:
-            # Step 1: Cleanup old data
-            _LOGGER.info("Step 1/4: Cleaning up old data")
+            # Step 1: Cleanup leftover downloads. The installed database is
+            # kept until the server has returned a changed feed in step 2.
+            _LOGGER.info("Step 1/4: Cleaning up old downloads")
             self._state["state"] = "downloading"
             self._state["progress"] = 0
             self._state["error"] = None
-            await self._cleanup_old_data()
+            await self._cleanup_old_download()
             
             # Step 2: Download new zip
             _LOGGER.info("Step 2/4: Downloading GTFS data")
             self._state["progress"] = 25
-            await self._download_with_retry()
+            downloaded = await self._download_with_retry()
+            if not downloaded or await self._is_installed_download():
+                # Feed is unchanged, keep the current database
+                _LOGGER.info("GTFS data not modified since last download")
+                self._metadata.update(self._download_validators)
+                self._metadata["last_download"] = datetime.now()
+                self._save_metadata()
+                await self._cleanup_old_download()
+                self._state["state"] = "idle"
+                self._state["progress"] = 100
+                return
             
             # Step 3: Convert to SQLite
             _LOGGER.info("Step 3/4: Converting to database (this may take 1-2 hours)")
             self._state["state"] = "converting"
             self._state["progress"] = 50
-            await self._convert_to_sqlite()
+            await self._cleanup_old_database()
+            schedule = await self._convert_to_sqlite()
             
             # Step 4: Validate
             _LOGGER.info("Step 4/4: Validating data")
             self._state["state"] = "validating"
             self._state["progress"] = 90
-            await self._validate_data()
+            await self._validate_data(schedule)
             
             # Update metadata
+            self._metadata.update(self._download_validators)
+            self._metadata["zip_blake2b"] = self._download_digest
             self._metadata["last_download"] = datetime.now()
             self._metadata["db_size_mb"] = round(self.db_path.stat().st_size / (1024 * 1024), 1)
             self._save_metadata()
@@ -124,7 +189,7 @@ class GTFSDataManager:
             # Cleanup zip file
             if self.zip_path.exists():
                 self.zip_path.unlink()
-                _LOGGER.debug(f"Cleaned up zip file: {self.zip_path}")
+                _LOGGER.debug("Cleaned up zip file: %s", self.zip_path)
             
             # Done
             self._state["state"] = "idle"
@@ -135,32 +200,44 @@ class GTFSDataManager:
             self._state["state"] = "error"
             self._state["error"] = str(err)
             self._state["progress"] = None
-            _LOGGER.error(f"GTFS data update failed: {err}")
+            _LOGGER.error("GTFS data update failed: %s", err)
             raise
 
-    async def _cleanup_old_data(self) -> None:
-        """Delete old database and zip files."""
+    async def _cleanup_old_database(self) -> None:
+        """Delete old database file."""
         if self.db_path.exists():
-            _LOGGER.info(f"Deleting old database: {self.db_path}")
+            _LOGGER.info("Deleting old database: %s", self.db_path)
             await self.hass.async_add_executor_job(self.db_path.unlink)
-        
+
+    async def _cleanup_old_download(self) -> None:
+        """Delete old zip files."""
         if self.zip_path.exists():
-            _LOGGER.info(f"Deleting old zip: {self.zip_path}")
+            _LOGGER.info("Deleting old zip: %s", self.zip_path)
             await self.hass.async_add_executor_job(self.zip_path.unlink)
 
-    async def _download_with_retry(self) -> None:
-        """Download GTFS zip with retry logic."""
+        # A partial download from an earlier update may belong to an older feed
+        await self.hass.async_add_executor_job(
+            partial(self.zip_part_path.unlink, missing_ok=True)
+        )
+
+    async def _download_with_retry(self) -> bool:
+        """Download GTFS zip with retry logic.
+
+        Returns False if the server reports the data as not modified.
+        """
+        # HA's shared session keeps connections alive, so retries (and resumed
+        # downloads) reuse the pooled connection instead of a new TLS handshake
+        session = async_get_clientsession(self.hass)
         for attempt in range(MAX_DOWNLOAD_RETRIES):
             try:
-                _LOGGER.debug(f"Download attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}")
-                await self._download_gtfs_zip()
-                return  # Success
+                _LOGGER.debug("Download attempt %s/%s", attempt + 1, MAX_DOWNLOAD_RETRIES)
+                return await self._download_gtfs_zip(session)
             except Exception as err:
-                _LOGGER.warning(f"Download attempt {attempt + 1} failed: {err}")
+                _LOGGER.warning("Download attempt %s failed: %s", attempt + 1, err)
                 
                 if attempt < MAX_DOWNLOAD_RETRIES - 1:
                     delay = RETRY_DELAYS[attempt]
-                    _LOGGER.info(f"Retrying in {delay} seconds...")
+                    _LOGGER.info("Retrying in %s seconds...", delay)
                     await asyncio.sleep(delay)
                 else:
                     # Final attempt failed
@@ -168,87 +245,540 @@ class GTFSDataManager:
                         f"Failed to download GTFS data after {MAX_DOWNLOAD_RETRIES} attempts"
                     ) from err
 
-    async def _download_gtfs_zip(self) -> None:
-        """Download GTFS zip file."""
-        session = async_get_clientsession(self.hass)
-        
-        _LOGGER.debug(f"Downloading from {self.data_url}")
-        
+    async def _download_gtfs_zip(self, session: aiohttp.ClientSession) -> bool:
+        """Download GTFS zip file.
+
+        Data is written to a .part file which is renamed into place once the
+        download completes. If a previous attempt left a partial file, the
+        download resumes from its end with an HTTP Range request, made
+        conditional with If-Range on the validators of that attempt. Otherwise,
+        if a database is installed, the request is made conditional on the
+        ETag/Last-Modified of the last download and False is returned when
+        the server answers 304 Not Modified. With parallel_download, large
+        files are fetched in parallel parts when the server supports ranges.
+        """
+        # Validators of the response a partial file was written from
+        part_validators = self._download_validators
+        self._download_validators = {}
+        self._download_digest = None
+
+        resume_from = await self.hass.async_add_executor_job(self._get_part_size)
+        headers: dict[str, str] = {}
+        if resume_from and (if_range := self._get_if_range(part_validators)):
+            # If the feed changed, the server sends all of it instead
+            headers["Range"] = f"bytes={resume_from}-"
+            headers["If-Range"] = if_range
+        elif resume_from:
+            # Without a validator the partial file can't be resumed safely
+            await self.hass.async_add_executor_job(self.zip_part_path.unlink)
+            resume_from = 0
+        if not resume_from and await self.hass.async_add_executor_job(
+            self.database_exists
+        ):
+            if etag := self._metadata.get("etag"):
+                headers["If-None-Match"] = etag
+            if last_modified := self._metadata.get("last_modified"):
+                headers["If-Modified-Since"] = last_modified
+
+        _LOGGER.debug("Downloading from %s", self.data_url)
+
+        downloaded = False
+        if self.parallel_download and not resume_from:
+            async with session.head(
+                self.data_url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=60)
+            ) as response:
+                if response.status == 304:
+                    return False
+                size = self._get_parallel_download_size(response)
+                validators = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            if size:
+                downloaded = await self._download_parts(session, size, validators)
+
+        if not downloaded and not await self._download_stream(
+            session, headers, resume_from
+        ):
+            return False
+
+        # Atomic rename, the zip is either complete or absent. It is not
+        # fsynced since it is only an intermediate that can be re-downloaded.
+        await self.hass.async_add_executor_job(
+            self.zip_part_path.replace, self.zip_path
+        )
+        _LOGGER.info("Downloaded GTFS data to %s", self.zip_path)
+        return True
+
+    @staticmethod
+    def _get_if_range(validators: Mapping[str, str | None]) -> str | None:
+        """Return an If-Range value for the validators, or None."""
+        etag = validators.get("etag")
+        # If-Range requires a strong validator
+        if etag and not etag.startswith("W/"):
+            return etag
+        return validators.get("last_modified")
+
+    @staticmethod
+    def _get_content_range_start(response: aiohttp.ClientResponse) -> int | None:
+        """Return the first byte position of a 206 response, or None."""
+        content_range = response.headers.get("Content-Range", "")
+        unit, _, byte_range = content_range.partition(" ")
+        start, _, _ = byte_range.partition("-")
+        if unit != "bytes" or not start.isdigit():
+            return None
+        return int(start)
+
+    @staticmethod
+    def _get_parallel_download_size(response: aiohttp.ClientResponse) -> int:
+        """Return the size of a HEAD response worth downloading in parts, or 0."""
+        if (
+            response.status != 200
+            or response.headers.get("Accept-Ranges") != "bytes"
+            or response.headers.get("Content-Encoding", "identity") != "identity"
+        ):
+            return 0
+        try:
+            size = int(response.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return 0
+        return size if size >= PARALLEL_DOWNLOAD_MIN_SIZE else 0
+
+    async def _download_parts(
+        self,
+        session: aiohttp.ClientSession,
+        size: int,
+        validators: dict[str, str | None],
+    ) -> bool:
+        """Download the zip as concurrent ranges into a preallocated .part file.
+
+        Returns False if the server doesn't serve the ranges, in which case
+        the caller falls back to a single stream. The ranges complete out of
+        order, so unlike a single stream the file is hashed by reading it
+        back once it is complete.
+        """
+        await self.hass.async_add_executor_job(self._allocate_part_file, size)
+
+        part_size = -(-size // PARALLEL_DOWNLOAD_PARTS)
+        ranges = [
+            (start, min(start + part_size, size) - 1)
+            for start in range(0, size, part_size)
+        ]
+        # If-Range makes the server send the whole (changed) file instead of
+        # a range, so parts of different versions are never mixed
+        if_range = self._get_if_range(validators)
+        tasks = [
+            asyncio.create_task(self._download_range(session, start, end, if_range))
+            for start, end in ranges
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other ranges and wait for them, so none is still
+            # writing to the file once it is removed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # The preallocated file can't be resumed from
+            await self.hass.async_add_executor_job(
+                partial(self.zip_part_path.unlink, missing_ok=True)
+            )
+            raise
+
+        if not all(results):
+            _LOGGER.debug("Server did not serve ranges, downloading as one stream")
+            await self.hass.async_add_executor_job(
+                partial(self.zip_part_path.unlink, missing_ok=True)
+            )
+            return False
+
+        self._download_validators = validators
+        digest = hashlib.blake2b()
+        await self.hass.async_add_executor_job(
+            self._hash_file, self.zip_part_path, digest
+        )
+        self._download_digest = digest.hexdigest()
+        return True
+
+    def _allocate_part_file(self, size: int) -> None:
+        """Create the .part file at its full size so ranges can be written."""
+        with open(self.zip_part_path, "wb") as f:
+            f.truncate(size)
+
+    async def _download_range(
+        self,
+        session: aiohttp.ClientSession,
+        start: int,
+        end: int,
+        if_range: str | None,
+    ) -> bool:
+        """Download one byte range into the .part file.
+
+        Returns False if the server answered with anything but the range.
+        """
+        headers = {"Range": f"bytes={start}-{end}"}
+        if if_range:
+            headers["If-Range"] = if_range
+
         async with session.get(
             self.data_url,
+            headers=headers,
             timeout=aiohttp.ClientTimeout(total=600)
         ) as response:
-            if response.status != 200:
+            if (
+                response.status != 206
+                or response.content_length != end - start + 1
+            ):
+                return False
+
+            f = await self.hass.async_add_executor_job(
+                open, self.zip_part_path, "r+b"
+            )
+            try:
+                await self.hass.async_add_executor_job(f.seek, start)
+                await self._write_response(response, f)
+            finally:
+                await self.hass.async_add_executor_job(f.close)
+        return True
+
+    async def _download_stream(
+        self,
+        session: aiohttp.ClientSession,
+        headers: dict[str, str],
+        resume_from: int,
+    ) -> bool:
+        """Download the zip as a single stream into the .part file.
+
+        Returns False if the server answers 304 Not Modified.
+        """
+        async with session.get(
+            self.data_url,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=600)
+        ) as response:
+            if response.status == 304:
+                return False
+            if response.status == 206:
+                if self._get_content_range_start(response) != resume_from:
+                    # Appending would corrupt the zip, start over
+                    await self.hass.async_add_executor_job(
+                        partial(self.zip_part_path.unlink, missing_ok=True)
+                    )
+                    raise HomeAssistantError(
+                        "Failed to resume GTFS download: unexpected Content-Range "
+                        f"{response.headers.get('Content-Range')}"
+                    )
+                _LOGGER.debug("Resuming download at byte %s", resume_from)
+                mode = "ab"
+            elif response.status == 200:
+                # Server ignored the range (or none was sent), start over
+                mode = "wb"
+            else:
+                if response.status == 416:
+                    # Partial file doesn't match the remote file, start over
+                    await self.hass.async_add_executor_job(
+                        partial(self.zip_part_path.unlink, missing_ok=True)
+                    )
                 raise HomeAssistantError(
                     f"Failed to download GTFS data: HTTP {response.status}"
                 )
-            
-            # Download in chunks
-            with open(self.zip_path, "wb") as f:
-                async for chunk in response.content.iter_chunked(8192):
-                    f.write(chunk)
-        
-        _LOGGER.info(f"Downloaded GTFS data to {self.zip_path}")
 
-    async def _convert_to_sqlite(self) -> None:
-        """Convert GTFS zip to SQLite database using pygtfs."""
-        def _convert():
+            # Remember the validators, they are stored once the data is installed
+            self._download_validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+            # The zip is hashed as it is written, so identical feeds can be
+            # recognized without reading the file back
+            digest = hashlib.blake2b()
+            if mode == "ab":
+                await self.hass.async_add_executor_job(
+                    self._hash_file, self.zip_part_path, digest
+                )
+
+            f = await self.hass.async_add_executor_job(
+                self._open_sequential, self.zip_part_path, mode
+            )
+            try:
+                await self._write_response(response, f, digest)
+            finally:
+                await self.hass.async_add_executor_job(f.close)
+
+        self._download_digest = digest.hexdigest()
+        return True
+
+    async def _write_response(
+        self,
+        response: aiohttp.ClientResponse,
+        f: BinaryIO,
+        digest: hashlib._Hash | None = None,
+    ) -> None:
+        """Write a response body to an open file, adding it to the digest.
+
+        The chunks are written as received, without copying them, in
+        batches of about DOWNLOAD_WRITE_BUFFER_SIZE bytes per executor job.
+        A batch is written while the next one is received, so the download
+        keeps reading from the socket during disk I/O. At most one write is
+        in flight, which keeps them in order.
+        """
+        chunks: list[bytes] = []
+        size = 0
+        pending: asyncio.Future[None] | None = None
+        try:
+            async for chunk in response.content.iter_any():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= DOWNLOAD_WRITE_BUFFER_SIZE:
+                    if pending is not None:
+                        await pending
+                    pending = self.hass.async_add_executor_job(
+                        self._write_chunks, f, digest, chunks
+                    )
+                    chunks = []
+                    size = 0
+        finally:
+            # The caller closes the file, make sure no write is left running
+            if pending is not None:
+                await pending
+        if chunks:
+            await self.hass.async_add_executor_job(
+                self._write_chunks, f, digest, chunks
+            )
+
+    @staticmethod
+    def _write_chunks(
+        f: BinaryIO, digest: hashlib._Hash | None, chunks: list[bytes]
+    ) -> None:
+        """Write downloaded data to file and add it to the digest."""
+        f.writelines(chunks)
+        if digest is not None:
+            for chunk in chunks:
+                digest.update(chunk)
+
+    @staticmethod
+    def _hash_file(path: Path, digest: hashlib._Hash) -> None:
+        """Add the contents of an existing file to the digest."""
+        with open(path, "rb") as f:
+            while data := f.read(DOWNLOAD_WRITE_BUFFER_SIZE):
+                digest.update(data)
+
+    async def _is_installed_download(self) -> bool:
+        """Check if the downloaded zip is the one the database was built from."""
+        installed_digest = self._metadata.get("zip_blake2b")
+        return (
+            installed_digest is not None
+            and installed_digest == self._download_digest
+            and await self.hass.async_add_executor_job(self.database_exists)
+        )
+
+    @staticmethod
+    def _open_sequential(path: Path, mode: str) -> BinaryIO:
+        """Open a file that is accessed from start to end."""
+        f = open(path, mode)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return f
+
+    @staticmethod
+    def _drop_from_page_cache(path: Path) -> None:
+        """Let the kernel drop the cached pages of a file that is done with."""
+        if not hasattr(os, "posix_fadvise"):
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+    def _get_part_size(self) -> int:
+        """Return the size of a partial download, or 0 if there is none."""
+        try:
+            return self.zip_part_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    async def _convert_to_sqlite(self) -> pygtfs.Schedule:
+        """Convert GTFS zip to SQLite database in the pygtfs schema.
+
+        Returns the schedule. Its engine still pools the connection to the
+        packed database that switched it to WAL, so validation can reuse it.
+        """
+        def _convert() -> pygtfs.Schedule:
             """Blocking conversion operation."""
-            _LOGGER.info("Starting pygtfs conversion (this will take a while)...")
+            _LOGGER.info("Starting GTFS conversion (this will take a while)...")
             
-            # Create schedule from zip
-            # pygtfs.append_feed creates/updates a SQLite database
+            # pygtfs creates the schema, the feed itself is bulk loaded
+            # into it by gtfs_loader.append_feed
+            self._create_empty_database()
             schedule = pygtfs.Schedule(str(self.db_path))
-            pygtfs.append_feed(schedule, str(self.zip_path))
+            set_pragmas = self._use_bulk_load_pragmas(schedule)
+
+            # Secondary indexes would be maintained row by row during the
+            # import, drop them and build ours in one pass afterwards
+            self._drop_indexes(schedule)
+            append_feed(
+                self.db_path, self.zip_path, BULK_LOAD_PRAGMAS, self.skip_tables
+            )
+            # The zip isn't read again, leave the page cache to the database
+            self._drop_from_page_cache(self.zip_path)
             
-            _LOGGER.info("pygtfs conversion completed")
+            _LOGGER.info("GTFS conversion completed")
             
             # Create performance indexes
             _LOGGER.info("Creating performance indexes...")
             self._create_indexes(schedule)
             _LOGGER.info("Indexes created")
+
+            self._pack_database(schedule)
+            event.remove(schedule.engine, "connect", set_pragmas)
+
+            # Back to a durable journal for the read workload
+            conn = schedule.engine.raw_connection()
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+            conn.close()
+            return schedule
         
         # Run in executor since it's CPU-intensive and blocking
-        await self.hass.async_add_executor_job(_convert)
+        return await self.hass.async_add_executor_job(_convert)
+
+    def _create_empty_database(self) -> None:
+        """Create the database file with the configured page size.
+
+        The page size can only be changed before any table exists, so it is
+        set up before pygtfs creates its schema.
+        """
+        conn = sqlite3.connect(str(self.db_path))
+        try:
+            conn.execute(f"PRAGMA page_size={DB_PAGE_SIZE}")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def _pack_database(self, schedule: pygtfs.Schedule) -> None:
+        """Rewrite the database into a compact copy and swap it in.
+
+        Pages of the primary key indexes are left partly filled by the
+        unordered inserts of the load. VACUUM INTO writes every table and
+        index into fully packed pages of a new file.
+        """
+        packed_path = self.db_path.with_name(f"{self.db_path.name}.packed")
+        packed_path.unlink(missing_ok=True)
+
+        conn = schedule.engine.raw_connection()
+        cursor = conn.cursor()
+        cursor.execute("VACUUM INTO ?", (str(packed_path),))
+        cursor.close()
+        conn.close()
+        schedule.engine.dispose()
+
+        os.replace(packed_path, self.db_path)
+        _LOGGER.debug("Packed database to %s bytes", self.db_path.stat().st_size)
+
+    def _use_bulk_load_pragmas(self, schedule: pygtfs.Schedule) -> Callable:
+        """Apply BULK_LOAD_PRAGMAS to every connection pygtfs opens.
+
+        Returns the connect listener, for removing it once loading is done.
+        """
+        @event.listens_for(schedule.engine, "connect")
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in BULK_LOAD_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+
+        # Drop connections opened while creating the schema, so every
+        # connection used for the import gets the pragmas
+        schedule.engine.dispose()
+        return _set_pragmas
+
+    def _drop_indexes(self, schedule: pygtfs.Schedule) -> None:
+        """Drop all secondary indexes from the database.
+
+        Only the indexes listed in _create_indexes are built again. The
+        other ones pygtfs declares, such as ix_calendar_service_id and
+        idx_trips_shape_id, serve lookups no query of the integration makes,
+        so they are left out on purpose.
+        """
+        conn = schedule.engine.raw_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type='index' AND name NOT LIKE 'sqlite_%'"
+        )
+        index_names = [row[0] for row in cursor.fetchall()]
+        if index_names:
+            cursor.executescript(
+                "BEGIN;\n"
+                + "".join(f'DROP INDEX IF EXISTS "{name}";\n' for name in index_names)
+                + "COMMIT;"
+            )
+            _LOGGER.debug("Dropped indexes before import: %s", ", ".join(index_names))
+
+        cursor.close()
+        conn.close()
 
     def _create_indexes(self, schedule: pygtfs.Schedule) -> None:
         """Create performance indexes on the database."""
         indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_stop_times_stop_id ON stop_times(stop_id)",
+            # Replace the id indexes pygtfs declares, which _drop_indexes
+            # removed. The primary keys are (feed_id, id), so they can't
+            # serve lookups by id alone.
+            "CREATE INDEX IF NOT EXISTS idx_agency_agency_id ON agency(agency_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stops_stop_id ON stops(stop_id)",
+            "CREATE INDEX IF NOT EXISTS idx_routes_route_id ON routes(route_id)",
+            "CREATE INDEX IF NOT EXISTS idx_trips_trip_id ON trips(trip_id)",
             "CREATE INDEX IF NOT EXISTS idx_stop_times_trip_id ON stop_times(trip_id)",
-            "CREATE INDEX IF NOT EXISTS idx_trips_route_id ON trips(route_id)",
             "CREATE INDEX IF NOT EXISTS idx_trips_service_id ON trips(service_id)",
             "CREATE INDEX IF NOT EXISTS idx_trips_direction_id ON trips(direction_id)",
             "CREATE INDEX IF NOT EXISTS idx_calendar_dates_service_id ON calendar_dates(service_id)",
-            "CREATE INDEX IF NOT EXISTS idx_calendar_dates_date ON calendar_dates(date)",
+            "CREATE INDEX IF NOT EXISTS idx_calendar_dates_date_service_id ON calendar_dates(date, service_id)",
             "CREATE INDEX IF NOT EXISTS idx_routes_agency_id ON routes(agency_id)",
-            "CREATE INDEX IF NOT EXISTS idx_stop_times_composite ON stop_times(stop_id, trip_id, departure_time)",
+            # Covers the stop_times columns of the departure and stop route
+            # queries, so they are answered from the index alone
+            "CREATE INDEX IF NOT EXISTS idx_stop_times_cover ON stop_times(stop_id, departure_time, trip_id, stop_headsign)",
+            "CREATE INDEX IF NOT EXISTS idx_trips_route_direction_service ON trips(route_id, direction_id, service_id)",
         ]
         
+        # Built in one transaction, still under the bulk load journal mode.
+        # SQLite allows a single writer, so instead of building indexes on
+        # several connections the sorter behind each CREATE INDEX is given
+        # worker threads.
         conn = schedule.engine.raw_connection()
         cursor = conn.cursor()
-        
-        for idx_sql in indexes:
-            try:
-                cursor.execute(idx_sql)
-                _LOGGER.debug(f"Created index: {idx_sql.split('idx_')[1].split(' ')[0]}")
-            except Exception as err:
-                _LOGGER.warning(f"Failed to create index: {err}")
-        
+        cursor.execute(f"PRAGMA threads={INDEX_SORT_THREADS}")
+        cursor.executescript(
+            "BEGIN;\n" + "".join(f"{idx_sql};\n" for idx_sql in indexes) + "COMMIT;"
+        )
+        _LOGGER.debug("Created %s indexes", len(indexes))
+
+        # Gather statistics so the planner picks the composite indexes, and
+        # let SQLite record that they are current
+        cursor.execute("ANALYZE")
+        cursor.execute("PRAGMA optimize")
         conn.commit()
         cursor.close()
+        conn.close()
 
-    async def _validate_data(self) -> None:
-        """Validate the converted database."""
+    async def _validate_data(self, schedule: pygtfs.Schedule) -> None:
+        """Validate the converted database.
+
+        Runs on the connection to the packed database pooled by the
+        schedule's engine, which is disposed afterwards.
+        """
         def _validate():
             """Blocking validation operation."""
-            import sqlite3
-            
             # Check database exists and is not corrupt
             if not self.db_path.exists():
+                schedule.engine.dispose()
                 raise HomeAssistantError("Database file not created")
             
-            conn = sqlite3.connect(str(self.db_path))
+            conn = schedule.engine.raw_connection()
             cursor = conn.cursor()
             
             try:
@@ -263,13 +793,21 @@ class GTFSDataManager:
                         f"Database missing required tables: {missing_tables}"
                     )
                 
-                # Check that tables have data
+                # Check that tables have data, EXISTS stops at the first row
+                # where COUNT(*) would scan the whole table
                 for table in required_tables:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                    count = cursor.fetchone()[0]
-                    if count == 0:
+                    cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {table})")
+                    if not cursor.fetchone()[0]:
                         raise HomeAssistantError(f"Table {table} is empty")
-                    _LOGGER.debug(f"Table {table}: {count} rows")
+
+                # Row counts for the log are taken from the ANALYZE statistics
+                if "sqlite_stat1" in existing_tables:
+                    cursor.execute("SELECT tbl, stat FROM sqlite_stat1")
+                    row_counts = {tbl: stat.split()[0] for tbl, stat in cursor}
+                    for table in required_tables:
+                        _LOGGER.debug(
+                            "Table %s: %s rows", table, row_counts.get(table, "unknown")
+                        )
                 
                 # Validate configured stops exist (if any devices configured)
                 # TODO: Check stops from hass.data when we implement device/sensor platform
@@ -279,6 +817,7 @@ class GTFSDataManager:
             finally:
                 cursor.close()
                 conn.close()
+                schedule.engine.dispose()
         
         await self.hass.async_add_executor_job(_validate)
 
@@ -0,0 +1,183 @@
+"""Bulk loader for GTFS feeds into a pygtfs schema."""
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import sqlite3
+import zipfile
+from collections.abc import Callable, Collection, Iterable, Iterator
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+from pygtfs.gtfs_entities import gtfs_all, gtfs_calendar, gtfs_required
+from sqlalchemy.types import Date, Interval
+
+_LOGGER = logging.getLogger(__name__)
+
+Converter = Callable[[str], Any]
+
+
+def _to_date(value: str) -> str:
+    """Convert a GTFS date (YYYYMMDD) to the format pygtfs stores."""
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+
+
+def _to_interval(value: str) -> str:
+    """Convert a GTFS time (H:MM:SS, may exceed 24h) to the format pygtfs stores.
+
+    pygtfs stores times as intervals, which SQLAlchemy persists on SQLite
+    as an offset from 1970-01-01.
+    """
+    hours, minutes, seconds = map(int, value.split(":"))
+    days, hours = divmod(hours, 24)
+    return f"1970-01-{days + 1:02d} {hours:02d}:{minutes:02d}:{seconds:02d}.000000"
+
+
+def _column_converter(column) -> Converter | None:
+    """Return the value converter for a pygtfs column, if one is needed.
+
+    Numbers and booleans are inserted as text and converted by the column
+    affinity, like the values pygtfs stores.
+    """
+    if isinstance(column.type, Interval):
+        return _to_interval
+    if isinstance(column.type, Date):
+        return _to_date
+    return None
+
+
+def _read_rows(
+    zip_file: zipfile.ZipFile, member: zipfile.ZipInfo, table, feed_id: int
+) -> tuple[list[str], Iterator[list[Any]]]:
+    """Open a feed file and return its known columns and converted rows.
+
+    Each row starts with feed_id, followed by the values of the columns.
+    The member is decompressed and parsed as it is read, it is never held
+    in memory or extracted to disk.
+    """
+    text = io.TextIOWrapper(
+        zip_file.open(member, "r"), encoding="utf-8-sig", newline=""
+    )
+    reader = csv.reader(text)
+    header = [name.strip() for name in next(reader)]
+
+    known_columns = set(table.columns.keys()) - {"feed_id"}
+    indices = [i for i, name in enumerate(header) if name in known_columns]
+    columns = [header[i] for i in indices]
+    defaults = []
+    converters = []
+    for name in columns:
+        column = table.columns[name]
+        default = column.default
+        defaults.append(
+            default.arg if default is not None and default.is_scalar else None
+        )
+        converters.append(_column_converter(column))
+
+    def rows() -> Iterator[list[Any]]:
+        try:
+            for row in reader:
+                if not row:
+                    continue
+                values = [feed_id]
+                for i, default, convert in zip(indices, defaults, converters):
+                    value = row[i].strip() if i < len(row) else ""
+                    if not value:
+                        values.append(default)
+                    elif convert is not None:
+                        values.append(convert(value))
+                    else:
+                        values.append(value)
+                yield values
+        finally:
+            text.close()
+
+    return columns, rows()
+
+
+def append_feed(
+    db_path: Path,
+    zip_path: Path,
+    pragmas: Iterable[str] = (),
+    skip_tables: Collection[str] = (),
+) -> int:
+    """Load a GTFS zip into a database created by pygtfs.Schedule.
+
+    Replaces pygtfs.append_feed, which inserts every row through the
+    SQLAlchemy ORM. Rows are streamed from the zip with csv into one
+    prepared statement per table (executemany), inside a single
+    transaction. The pygtfs schema and value formats are kept, so the
+    database reads the same through pygtfs.
+    The _trip_shapes and _stop_translations mapping tables are not filled.
+    pragmas are executed on the connection before loading. Files of the
+    tables in skip_tables are not read, those tables stay empty.
+
+    Returns the id of the new feed.
+    """
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    try:
+        for pragma in pragmas:
+            conn.execute(pragma)
+
+        with zipfile.ZipFile(zip_path) as zip_file:
+            members = {info.filename: info for info in zip_file.infolist()}
+            for gtfs_class in gtfs_required:
+                if f"{gtfs_class.__tablename__}.txt" not in members:
+                    raise OSError(
+                        f"Error: could not find {gtfs_class.__tablename__}.txt"
+                    )
+            if not any(f"{c.__tablename__}.txt" in members for c in gtfs_calendar):
+                raise OSError("Must have calendar.txt or calendar_dates.txt")
+
+            conn.execute("BEGIN EXCLUSIVE")
+            feed_id = conn.execute(
+                "INSERT INTO _feed (feed_name, feed_append_date) VALUES (?, ?)",
+                (zip_path.name, date.today().isoformat()),
+            ).lastrowid
+
+            for gtfs_class in gtfs_all:
+                table = gtfs_class.__table__
+                member = members.get(f"{table.name}.txt")
+                if member is None:
+                    continue
+                if table.name in skip_tables:
+                    _LOGGER.debug("Skipping %s", member.filename)
+                    continue
+
+                columns, rows = _read_rows(zip_file, member, table, feed_id)
+                sql = (
+                    f"INSERT INTO {table.name} (feed_id, {', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * (len(columns) + 1))})"
+                )
+                count = conn.executemany(sql, rows).rowcount
+                _LOGGER.debug("Loaded %s rows into %s", count, table.name)
+
+            # Like pygtfs, give services that only appear in calendar_dates
+            # a calendar entry without regular service days
+            conn.execute(
+                """
+                INSERT INTO calendar (
+                    feed_id, service_id, monday, tuesday, wednesday, thursday,
+                    friday, saturday, sunday, start_date, end_date
+                )
+                SELECT feed_id, service_id, 0, 0, 0, 0, 0, 0, 0, MIN(date), MIN(date)
+                FROM calendar_dates
+                WHERE feed_id = :feed_id
+                AND service_id NOT IN (
+                    SELECT service_id FROM calendar WHERE feed_id = :feed_id
+                )
+                GROUP BY feed_id, service_id
+                """,
+                {"feed_id": feed_id},
+            )
+            conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    return feed_id
@@ -50,6 +50,11 @@ class GTFSUpdateEntity(UpdateEntity):
         # Get data manager
         self._data_manager: GTFSDataManager = hass.data[DOMAIN][entry.entry_id]["data_manager"]
 
+        # Read-only views that follow the data manager, so the properties
+        # don't have to fetch them on every state write
+        self._metadata = self._data_manager.get_metadata()
+        self._state = self._data_manager.get_state()
+
     @property
     def device_info(self):
         """Return device info."""
@@ -65,7 +70,7 @@ class GTFSUpdateEntity(UpdateEntity):
     @property
     def installed_version(self) -> str | None:
         """Version of currently installed GTFS data."""
-        metadata = self._data_manager.get_metadata()
+        metadata = self._metadata
         if metadata and metadata.get("last_download"):
             # Return date as version string
             last_download = metadata["last_download"]
@@ -90,20 +95,18 @@ class GTFSUpdateEntity(UpdateEntity):
     @property
     def update_percentage(self) -> int | None:
         """Update progress percentage."""
-        state = self._data_manager.get_state()
-        return state.get("progress")
+        return self._state.get("progress")
 
     @property
     def in_progress(self) -> bool:
         """Update installation in progress."""
-        state = self._data_manager.get_state()
-        return state.get("state") in ["downloading", "converting", "validating"]
+        return self._state.get("state") in ["downloading", "converting", "validating"]
 
     @property
     def extra_state_attributes(self) -> dict[str, Any]:
         """Return extra state attributes."""
-        metadata = self._data_manager.get_metadata()
-        state = self._data_manager.get_state()
+        metadata = self._metadata
+        state = self._state
         
         attrs = {
             "last_download": metadata.get("last_download"),
@@ -143,7 +146,7 @@ class GTFSUpdateEntity(UpdateEntity):
             _LOGGER.info("GTFS data update completed successfully")
             
         except Exception as err:
-            _LOGGER.error(f"Failed to update GTFS data: {err}")
+            _LOGGER.error("Failed to update GTFS data: %s", err)
             # Error is stored in data manager state, will show in attributes
             self.async_write_ha_state()
             raise
@@ -0,0 +1,10 @@
+"""Utility functions for the GTFS Skåne integration."""
+from __future__ import annotations
+
+from yarl import URL
+
+
+def build_data_url(data_url_template: str, operating_area: str, api_key: str) -> str:
+    """Build the GTFS download URL with the API key as query parameter."""
+    data_url = URL(data_url_template.format(operating_area=operating_area))
+    return str(data_url.update_query(key=api_key))